@@ -51,6 +51,11 @@ class EcommerceItem(Document):
 			self.inventory_synced_on = get_datetime("1970-01-01")
 
 
+def on_doctype_update():
+	# is_synced and get_erpnext_item_code look up items by these two columns
+	frappe.db.add_index("Ecommerce Item", ["integration", "integration_item_code"])
+
+
 def is_synced(
 	integration: str,
 	integration_item_code: str,
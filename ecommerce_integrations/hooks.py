@@ -137,7 +137,10 @@ doc_events = {
 # ---------------
 
 scheduler_events = {
-    "all": ["ecommerce_integrations.shopify.inventory.update_inventory_on_shopify"],
+    "all": [
+        "ecommerce_integrations.shopify.inventory.update_inventory_on_shopify",
+        "ecommerce_integrations.shopify.bulk_product_import.poll_pending_bulk_import",
+    ],
     "daily": [],
     "daily_long": [
         "ecommerce_integrations.zenoti.doctype.zenoti_settings.zenoti_settings.sync_stocks"
@@ -0,0 +1,7 @@
+from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item.ecommerce_item import (
+	on_doctype_update,
+)
+
+
+def execute():
+	on_doctype_update()
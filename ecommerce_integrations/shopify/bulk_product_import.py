@@ -1,116 +1,175 @@
-import json
 import time
-from enum import Enum
-from typing import List, Optional, Tuple
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timezone
+from enum import IntEnum
+from itertools import islice
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
 
 import frappe
 import requests
 from frappe import _
+from frappe.utils import get_datetime, get_system_timezone, now_datetime
+from requests.adapters import HTTPAdapter
 from shopify import GraphQL
+from urllib3.util.retry import Retry
 
 from ecommerce_integrations.shopify.connection import temp_shopify_session
-from ecommerce_integrations.shopify.constants import SETTING_DOCTYPE
+from ecommerce_integrations.shopify.constants import MAX_SYNC_WORKERS, SETTING_DOCTYPE
 from ecommerce_integrations.shopify.product import ShopifyProduct
-from ecommerce_integrations.shopify.utils import create_shopify_log
+from ecommerce_integrations.shopify.utils import create_shopify_log, run_in_site_context
 
+try:
+    # orjson ships with frappe, fall back to stdlib json if it is unavailable
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-class BulkOperationStatus(Enum):
-    CREATED = "CREATED"
-    RUNNING = "RUNNING"
-    COMPLETED = "COMPLETED"
-    FAILED = "FAILED"
-    CANCELED = "CANCELED"
-    EXPIRED = "EXPIRED"
+# size of raw byte chunks pulled from the bulk data response
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+# number of products synced per transaction during bulk import
+IMPORT_BATCH_SIZE = 500
+# times a batch rolled back by a database deadlock is imported again
+IMPORT_DEADLOCK_RETRIES = 2
+# (connect, read) timeout in seconds for bulk data downloads
+DOWNLOAD_TIMEOUT = (5, 60)
+# bulk exports identify products by GraphQL GID, REST and Ecommerce Item use the numeric id
+PRODUCT_GID_PREFIX = "gid://shopify/Product/"
+
+# GraphQL mutation for bulk product export, the inner query is passed as a
+# GraphQL block string so it needs no escaping. %s takes an optional filter on
+# the products connection.
+# Only product ids are exported, ShopifyProduct fetches the full product when
+# syncing. Nested connections (variants, images) would also be emitted as extra
+# JSONL lines that are not products.
+_BULK_QUERY_TEMPLATE = '''
+mutation {
+    bulkOperationRunQuery(
+        query: """
+        {
+            products%s {
+                edges {
+                    node {
+                        id
+                    }
+                }
+            }
+        }
+        """
+    ) {
+        bulkOperation {
+            id
+            status
+            url
+        }
+        userErrors {
+            field
+            message
+        }
+    }
+}
+'''
+_BULK_QUERY = _BULK_QUERY_TEMPLATE % ""
+
+# status of a bulk operation, the operation id is passed as a variable
+_BULK_OPERATION_STATUS_QUERY = """
+query ($id: ID!) {
+    node(id: $id) {
+        ... on BulkOperation {
+            status
+            url
+        }
+    }
+}
+"""
+
+
+def _get_bulk_query(updated_after=None) -> str:
+    """Bulk export query, limited to products updated after the given time if set.
+
+    updated_after is a naive datetime in the system timezone (e.g. from
+    now_datetime), it is sent to Shopify in UTC.
+    """
+    if not updated_after:
+        return _BULK_QUERY
+
+    updated_after = get_datetime(updated_after)
+    if not updated_after.tzinfo:
+        updated_after = updated_after.replace(tzinfo=ZoneInfo(get_system_timezone()))
+    timestamp = updated_after.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return _BULK_QUERY_TEMPLATE % f'(query: "updated_at:>\'{timestamp}\'")'
+
+
+# shared session so bulk data downloads reuse pooled connections and retry
+# transient CDN errors with backoff
+_DOWNLOAD_SESSION = requests.Session()
+_DOWNLOAD_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)
+        ),
+    ),
+)
+
+
+class BulkOperationStatus(IntEnum):
+    """Bulk operation states, looked up by name from the GraphQL response.
+
+    Values with the UNSUCCESSFUL_STATUS_MASK bit set are terminal states that
+    produced no export.
+    """
+
+    CREATED = 0
+    RUNNING = 1
+    COMPLETED = 2
+    CANCELING = 3
+    FAILED = 4
+    CANCELED = 5
+    EXPIRED = 6
+
+
+UNSUCCESSFUL_STATUS_MASK = 0b100
+
+
+class BulkOperationError(frappe.ValidationError):
+    """The bulk operation failed, was canceled or expired"""
 
 
 class BulkProductImport:
-    def __init__(self, poll_interval: int = 30, max_retries: int = 10):
-        self.setting = frappe.get_doc(SETTING_DOCTYPE)
+    def __init__(
+        self,
+        poll_interval: int = 30,
+        max_retries: int = 10,
+        max_poll_interval: int = 600,
+        # serial unless asked for, product sync isn't known to be thread-safe
+        max_workers: int = 1,
+    ):
+        self.setting = frappe.get_cached_doc(SETTING_DOCTYPE)
         self.poll_interval = poll_interval
         self.max_retries = max_retries
+        self.max_poll_interval = max_poll_interval
+        self.max_workers = max(1, min(max_workers, MAX_SYNC_WORKERS))
 
         if not self.setting.is_enabled():
             frappe.throw(_("Shopify integration is not enabled"))
 
-    def _create_bulk_query(self) -> str:
-        """Create GraphQL query for bulk product export"""
-        return """
-        mutation {
-            bulkOperationRunQuery(
-                query: """
-        +json.dumps(
-            """
-            {
-                products {
-                    edges {
-                        node {
-                            id
-                            title
-                            description
-                            productType
-                            vendor
-                            status
-                            tags
-                            variants {
-                                edges {
-                                    node {
-                                        id
-                                        sku
-                                        title
-                                        price
-                                        compareAtPrice
-                                        inventoryQuantity
-                                        weight
-                                        weightUnit
-                                        option1
-                                        option2
-                                        option3
-                                    }
-                                }
-                            }
-                            options {
-                                name
-                                values
-                            }
-                            images {
-                                edges {
-                                    node {
-                                        id
-                                        src
-                                        altText
-                                    }
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-            """
-        ).replace('"', '\\"')
-        +"""
-            }
-        ) {
-            bulkOperation {
-                id
-                status
-                url
-            }
-            userErrors {
-                field
-                message
-            }
-        }
-    }
-    """
-
     @temp_shopify_session
     def start_bulk_operation(self) -> str:
-        """Start a bulk operation to export all products"""
+        """Start a bulk operation to export products changed since the last import"""
         client = GraphQL()
-        response = client.execute(self._create_bulk_query())
+        # execute returns the raw JSON body
+        response = json_loads(
+            client.execute(_get_bulk_query(self.setting.get("last_bulk_product_import")))
+        )
 
-        if "errors" in response:
-            error_message = "\n".join(error["message"] for error in response["errors"])
+        result = (response.get("data") or {}).get("bulkOperationRunQuery") or {}
+        errors = response.get("errors") or result.get("userErrors")
+        if errors:
+            error_message = "\n".join(error["message"] for error in errors)
             create_shopify_log(
                 status="Error",
                 message=f"Failed to start bulk operation: {error_message}",
@@ -118,48 +177,55 @@ class BulkProductImport:
             )
             frappe.throw(_("Failed to start bulk operation: {0}").format(error_message))
 
-        operation = response["data"]["bulkOperationRunQuery"]["bulkOperation"]
-        return operation["id"]
+        return result["bulkOperation"]["id"]
+
+    def _get_poll_delay(self, retries: int) -> int:
+        """Exponential backoff between polls, capped at max_poll_interval"""
+        return min(self.poll_interval * 2**retries, self.max_poll_interval)
 
     @temp_shopify_session
-    def poll_bulk_operation(
+    def get_bulk_operation_status(
         self, operation_id: str
     ) -> Tuple[BulkOperationStatus, Optional[str]]:
-        """Poll the status of a bulk operation until completion"""
-        query = (
-            """
-        query {
-            node(id: "%s") {
-                ... on BulkOperation {
-                    status
-                    url
-                }
-            }
-        }
+        """Fetch the current status of a bulk operation.
+
+        Raises if the operation failed, was canceled or expired.
         """
-            % operation_id
+        response = json_loads(
+            GraphQL().execute(_BULK_OPERATION_STATUS_QUERY, variables={"id": operation_id})
         )
+        operation = response["data"]["node"]
+        status = BulkOperationStatus[operation["status"]]
 
-        client = GraphQL()
+        if status & UNSUCCESSFUL_STATUS_MASK:
+            state = status.name.lower()
+            create_shopify_log(
+                status="Error",
+                message=f"Bulk operation {state}: {operation_id}",
+                response_data=response,
+            )
+            frappe.throw(_("Bulk operation {0}").format(state), exc=BulkOperationError)
+
+        return status, operation.get("url")
+
+    @temp_shopify_session
+    def poll_bulk_operation(
+        self, operation_id: str
+    ) -> Tuple[BulkOperationStatus, Optional[str]]:
+        """Poll the status of a bulk operation until completion.
+
+        The wait between polls doubles on every retry so long running exports
+        consume fewer GraphQL calls.
+        """
         retries = 0
 
         while retries < self.max_retries:
-            response = client.execute(query)
-            operation = response["data"]["node"]
-            status = BulkOperationStatus(operation["status"])
-
-            if status in [BulkOperationStatus.COMPLETED, BulkOperationStatus.FAILED]:
-                return status, operation.get("url")
-
-            if status == BulkOperationStatus.FAILED:
-                create_shopify_log(
-                    status="Error",
-                    message=f"Bulk operation failed: {operation_id}",
-                    response_data=response,
-                )
-                frappe.throw(_("Bulk operation failed"))
+            status, url = self.get_bulk_operation_status(operation_id)
+
+            if status is BulkOperationStatus.COMPLETED:
+                return status, url
 
-            time.sleep(self.poll_interval)
+            time.sleep(self._get_poll_delay(retries))
             retries += 1
 
         create_shopify_log(
@@ -172,40 +238,150 @@ class BulkProductImport:
         )
 
     @staticmethod
-    def _parse_jsonl_data(jsonl_data: str) -> List[dict]:
+    def _iter_jsonl(byte_chunks: Iterable[bytes]) -> Iterator[dict]:
+        """Lazily parse JSONL from raw byte chunks, yielding one record per line.
+
+        Lines may span chunk boundaries, so the incomplete tail of each chunk is
+        carried over into the next one.
+        """
+        buffer = bytearray()
+        for chunk in byte_chunks:
+            buffer.extend(chunk)
+
+            start = 0
+            while (end := buffer.find(b"\n", start)) != -1:
+                line = bytes(buffer[start:end])
+                start = end + 1
+                if line.strip():
+                    yield json_loads(line)
+
+            del buffer[:start]
+
+        if buffer.strip():
+            yield json_loads(bytes(buffer))
+
+    @staticmethod
+    def _parse_jsonl_data(jsonl_data: str) -> list[dict]:
         """Parse JSONL data into a list of product dictionaries"""
-        products = []
-        for line in jsonl_data.strip().split("\n"):
-            if line:
-                products.append(json.loads(line))
-        return products
-
-    def _download_bulk_data(self, url: str) -> str:
-        """Download bulk data from the provided URL"""
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.text
-
-    def import_products(self, data_url: str) -> None:
-        """Import products from bulk data"""
-        try:
-            jsonl_data = self._download_bulk_data(data_url)
-            products = self._parse_jsonl_data(jsonl_data)
-
-            for product_data in products:
-                try:
-                    product = ShopifyProduct(product_id=product_data["id"])
-                    product.sync_product()
-                except Exception as e:
-                    create_shopify_log(
-                        status="Error",
-                        message=f"Failed to import product {product_data.get('id')}: {str(e)}",
-                        response_data=product_data,
-                    )
-                    frappe.log_error(
-                        title="Shopify Bulk Import Error",
-                        message=f"Failed to import product {product_data.get('id')}: {str(e)}",
+        return list(BulkProductImport._iter_jsonl([jsonl_data.encode()]))
+
+    def _download_bulk_data(self, url: str) -> Iterator[bytes]:
+        """Stream bulk data from the provided URL as raw byte chunks.
+
+        Chunks are yielded as they arrive so parsing and syncing overlap with the
+        download, the connection is released once the stream is exhausted.
+        """
+        with _DOWNLOAD_SESSION.get(
+            url, stream=True, timeout=DOWNLOAD_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+
+    @staticmethod
+    def _iter_batches(
+        records: Iterable[dict], batch_size: int = IMPORT_BATCH_SIZE
+    ) -> Iterator[list[dict]]:
+        """Group records into lists of at most batch_size items"""
+        records = iter(records)
+        while batch := list(islice(records, batch_size)):
+            yield batch
+
+    def _import_batch(self, batch: list[dict], retries: int = IMPORT_DEADLOCK_RETRIES) -> int:
+        """Sync a batch of products and commit them in a single transaction.
+
+        A deadlock rolls back the whole transaction, savepoint included, so the
+        batch is imported again from scratch, after the last retry all of its
+        products count as failed.
+
+        Returns the number of products that failed to sync.
+        """
+        savepoint = "shopify_bulk_product_import"
+        failures = []
+        for product_data in batch:
+            try:
+                frappe.db.savepoint(savepoint)
+                product_id = product_data["id"].removeprefix(PRODUCT_GID_PREFIX)
+                product = ShopifyProduct(product_id=product_id)
+                product.sync_product()
+            except frappe.QueryDeadlockError as e:
+                frappe.db.rollback()
+                if retries:
+                    return self._import_batch(batch, retries - 1)
+                failures = [self._get_failure(data, e) for data in batch]
+                break
+            except Exception as e:
+                frappe.db.rollback(save_point=savepoint)
+                failures.append(self._get_failure(product_data, e))
+
+        if failures:
+            self._log_failures(failures)
+
+        frappe.db.commit()
+        return len(failures)
+
+    @staticmethod
+    def _get_failure(product_data: dict, error: Exception) -> dict:
+        return {
+            "product": product_data,
+            "error": str(error),
+            "traceback": frappe.get_traceback(),
+        }
+
+    @staticmethod
+    def _log_failures(failures: list[dict]) -> None:
+        """Record all failed products of a batch in a single Shopify log"""
+        product_ids = ", ".join(str(f["product"].get("id")) for f in failures)
+        create_shopify_log(
+            status="Error",
+            message=f"Failed to import {len(failures)} product(s): {product_ids}",
+            response_data=failures,
+        )
+
+    def _import_batches_parallel(self, batches: Iterable[list[dict]]) -> int:
+        """Import batches on a bounded thread pool.
+
+        At most max_workers batches are in flight, so the JSONL stream is still
+        consumed lazily. Returns the number of products that failed to sync.
+        """
+        site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+        pending = set()
+        failed = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch in batches:
+                if len(pending) >= self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        failed += future.result()
+
+                pending.add(
+                    executor.submit(
+                        run_in_site_context, site, sites_path, user, self._import_batch, batch
                     )
+                )
+
+            for future in wait(pending).done:
+                failed += future.result()
+
+        return failed
+
+    def import_products(self, data_url: str, started_at=None) -> None:
+        """Import products from bulk data.
+
+        If every product synced, started_at (the time the bulk operation was
+        started) is stored so the next export only fetches newer changes.
+        """
+        try:
+            byte_chunks = self._download_bulk_data(data_url)
+            batches = self._iter_batches(self._iter_jsonl(byte_chunks))
+
+            if self.max_workers > 1:
+                failed = self._import_batches_parallel(batches)
+            else:
+                failed = sum(self._import_batch(batch) for batch in batches)
+
+            if started_at and not failed:
+                _set_last_bulk_product_import(started_at)
 
         except Exception as e:
             create_shopify_log(
@@ -215,17 +391,33 @@ class BulkProductImport:
             )
             frappe.throw(_("Failed to process bulk data: {0}").format(str(e)))
 
+    def queue_bulk_import(self) -> str:
+        """Start a bulk operation and leave the waiting to the scheduler.
+
+        Unlike run_bulk_import this doesn't hold a worker while Shopify prepares
+        the export, see `poll_pending_bulk_import`.
+        """
+        started_at = now_datetime()
+        operation_id = self.start_bulk_operation()
+        _set_pending_bulk_operation(operation_id, started_at)
+        return operation_id
+
     def run_bulk_import(self) -> None:
         """Run the complete bulk import process"""
         try:
+            started_at = now_datetime()
             operation_id = self.start_bulk_operation()
             status, data_url = self.poll_bulk_operation(operation_id)
 
-            if status == BulkOperationStatus.COMPLETED and data_url:
-                self.import_products(data_url)
-            else:
+            if status != BulkOperationStatus.COMPLETED:
                 frappe.throw(_("Bulk operation did not complete successfully"))
 
+            if data_url:
+                self.import_products(data_url, started_at)
+            else:
+                # no url, no product changed since the last import
+                _set_last_bulk_product_import(started_at)
+
         except Exception as e:
             create_shopify_log(
                 status="Error",
@@ -233,3 +425,75 @@ class BulkProductImport:
                 response_data={"error": str(e)},
             )
             frappe.throw(_("Bulk import failed: {0}").format(str(e)))
+
+
+def poll_pending_bulk_import():
+    """Enqueue the product import once the pending bulk operation completes.
+
+    Runs on every scheduler tick, so no worker sits idle waiting on Shopify.
+    The pending operation is only dropped once it reached a terminal state,
+    other errors are logged and the operation is polled again on the next tick.
+    """
+    operation_id = frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation")
+    # kept pending while the integration is disabled, polled again once enabled
+    if not operation_id or not frappe.get_cached_doc(SETTING_DOCTYPE).is_enabled():
+        return
+
+    try:
+        status, data_url = BulkProductImport().get_bulk_operation_status(operation_id)
+    except BulkOperationError:
+        # logged by get_bulk_operation_status, nothing left to import
+        _set_pending_bulk_operation(None, None)
+        return
+    except Exception as e:
+        create_shopify_log(
+            status="Error",
+            message=f"Failed to poll bulk operation {operation_id}: {e!s}",
+            response_data={"operation_id": operation_id},
+        )
+        return
+
+    if status is not BulkOperationStatus.COMPLETED:
+        return
+
+    started_at = frappe.db.get_single_value(
+        SETTING_DOCTYPE, "pending_bulk_operation_started_at"
+    )
+    _set_pending_bulk_operation(None, None)
+    if data_url:
+        frappe.enqueue(
+            import_bulk_data,
+            queue="long",
+            timeout=864000,  # 10 days in seconds
+            job_name=f"shopify_bulk_import_{operation_id}",
+            data_url=data_url,
+            started_at=started_at,
+        )
+    else:
+        # no url, no product changed since the last import
+        _set_last_bulk_product_import(started_at)
+
+
+def _set_last_bulk_product_import(started_at) -> None:
+    """Only products updated after started_at are exported by the next import"""
+    frappe.db.set_value(
+        SETTING_DOCTYPE, None, "last_bulk_product_import", started_at, update_modified=False
+    )
+
+
+def _set_pending_bulk_operation(operation_id, started_at) -> None:
+    """Store the bulk operation waiting to be imported, None clears it"""
+    frappe.db.set_value(
+        SETTING_DOCTYPE,
+        None,
+        {
+            "pending_bulk_operation": operation_id,
+            "pending_bulk_operation_started_at": started_at,
+        },
+        update_modified=False,
+    )
+
+
+def import_bulk_data(data_url: str, started_at=None) -> None:
+    """Background job to import products from a completed bulk export"""
+    BulkProductImport().import_products(data_url, started_at)
@@ -3,6 +3,7 @@ import functools
 import hashlib
 import hmac
 import json
+from contextlib import contextmanager
 
 import frappe
 from frappe import _
@@ -27,7 +28,7 @@ def temp_shopify_session(func):
 		if frappe.flags.in_test:
 			return func(*args, **kwargs)
 
-		setting = frappe.get_doc(SETTING_DOCTYPE)
+		setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 		if setting.is_enabled():
 			auth_details = (setting.shopify_url, API_VERSION, setting.get_password("password"))
 
@@ -37,6 +38,26 @@ def temp_shopify_session(func):
 	return wrapper
 
 
+@contextmanager
+def shopify_session():
+	"""Context manager variant of temp_shopify_session.
+
+	Keeps one session open for a block making many API calls, e.g. a sync job."""
+
+	# no auth in testing
+	if frappe.flags.in_test:
+		yield
+		return
+
+	setting = frappe.get_cached_doc(SETTING_DOCTYPE)
+	if not setting.is_enabled():
+		frappe.throw(_("Shopify integration is not enabled"))
+
+	auth_details = (setting.shopify_url, API_VERSION, setting.get_password("password"))
+	with Session.temp(*auth_details):
+		yield
+
+
 def register_webhooks(shopify_url: str, password: str) -> list[Webhook]:
 	"""Register required webhooks with shopify and return registered webhooks."""
 	new_webhooks = []
@@ -3,6 +3,8 @@
 
 """Constants used in Shopify integration."""
 
+from types import MappingProxyType
+
 MODULE_NAME = "shopify"
 
 SETTING_DOCTYPE = "Shopify Setting"  # moved to setting_constants.py
@@ -17,10 +19,15 @@ ORDER_STATUS_FIELD = "shopify_order_status"
 ORDER_ITEM_DISCOUNT_FIELD = "shopify_item_discount"
 FULLFILLMENT_ID_FIELD = "shopify_fulfillment_id"
 
-SHOPIFY_VARIANTS_ATTR_LIST = ["option1", "option2", "option3"]
+# upper bound on threads syncing with Shopify at once, keeps within its API rate limit
+MAX_SYNC_WORKERS = 4
+
+SHOPIFY_VARIANTS_ATTR_LIST = ("option1", "option2", "option3")
 
 # ERPNext already defines the default UOMs from Shopify but names are different
-WEIGHT_TO_ERPNEXT_UOM_MAP = {
-    "g": "Gram",
-    "kg": "Kg",
-}
+WEIGHT_TO_ERPNEXT_UOM_MAP = MappingProxyType(
+    {
+        "g": "Gram",
+        "kg": "Kg",
+    }
+)
@@ -39,6 +39,7 @@ class ShopifySetting(SettingController):
 
     def validate(self):
         ensure_old_connector_is_disabled()
+        self._clear_warehouse_mapping_cache()
 
         if self.shopify_url:
             self.shopify_url = self.shopify_url.replace("https://", "")
@@ -102,6 +103,7 @@ class ShopifySetting(SettingController):
         map it with correct ERPNext warehouse."""
 
         self.shopify_warehouse_mapping = []
+        self._clear_warehouse_mapping_cache()
         for locations in PaginatedIterator(Location.find()):
             for location in locations:
                 self.append(
@@ -113,23 +115,40 @@ class ShopifySetting(SettingController):
                 )
 
     def get_erpnext_warehouses(self) -> list[ERPNextWarehouse]:
-        return [wh_map.erpnext_warehouse for wh_map in self.shopify_warehouse_mapping]
+        if "_erpnext_warehouses" not in self.__dict__:
+            self.__dict__["_erpnext_warehouses"] = [
+                wh_map.erpnext_warehouse for wh_map in self.shopify_warehouse_mapping
+            ]
+        return self.__dict__["_erpnext_warehouses"]
 
     def get_erpnext_to_integration_wh_mapping(
         self,
     ) -> dict[ERPNextWarehouse, IntegrationWarehouse]:
-        return {
-            wh_map.erpnext_warehouse: wh_map.shopify_location_id
-            for wh_map in self.shopify_warehouse_mapping
-        }
+        if "_erpnext_to_integration_wh_mapping" not in self.__dict__:
+            self.__dict__["_erpnext_to_integration_wh_mapping"] = {
+                wh_map.erpnext_warehouse: wh_map.shopify_location_id
+                for wh_map in self.shopify_warehouse_mapping
+            }
+        return self.__dict__["_erpnext_to_integration_wh_mapping"]
 
     def get_integration_to_erpnext_wh_mapping(
         self,
     ) -> dict[IntegrationWarehouse, ERPNextWarehouse]:
-        return {
-            wh_map.shopify_location_id: wh_map.erpnext_warehouse
-            for wh_map in self.shopify_warehouse_mapping
-        }
+        if "_integration_to_erpnext_wh_mapping" not in self.__dict__:
+            self.__dict__["_integration_to_erpnext_wh_mapping"] = {
+                wh_map.shopify_location_id: wh_map.erpnext_warehouse
+                for wh_map in self.shopify_warehouse_mapping
+            }
+        return self.__dict__["_integration_to_erpnext_wh_mapping"]
+
+    def _clear_warehouse_mapping_cache(self):
+        """Drop warehouse lists/maps cached by the getters above."""
+        for key in (
+            "_erpnext_warehouses",
+            "_erpnext_to_integration_wh_mapping",
+            "_integration_to_erpnext_wh_mapping",
+        ):
+            self.__dict__.pop(key, None)
 
     def validate_settings(self):
         if self.enable_sync:
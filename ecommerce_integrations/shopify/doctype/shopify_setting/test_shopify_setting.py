@@ -121,3 +121,18 @@ class TestShopifySetting(FrappeTestCase):
 
         with pytest.raises(frappe.ValidationError):
             self.setting.import_products_bulk()
+
+    def test_warehouse_mapping_cache(self):
+        """Test warehouse mappings are cached until cleared"""
+        self.setting.shopify_warehouse_mapping = []
+        self.setting.append(
+            "shopify_warehouse_mapping",
+            {"shopify_location_id": "1", "erpnext_warehouse": "_Test Warehouse - _TC"},
+        )
+
+        mapping = self.setting.get_integration_to_erpnext_wh_mapping()
+        assert mapping == {"1": "_Test Warehouse - _TC"}
+        assert self.setting.get_integration_to_erpnext_wh_mapping() is mapping
+
+        self.setting._clear_warehouse_mapping_cache()
+        assert self.setting.get_integration_to_erpnext_wh_mapping() is not mapping
@@ -10,7 +10,7 @@ from ecommerce_integrations.shopify.product_class import ShopifyProduct
 
 def enqueue_bulk_product_import():
     """Enqueue bulk product import job with 10-day timeout"""
-    setting = frappe.get_doc(SETTING_DOCTYPE)
+    setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 
     if not setting.is_enabled():
         frappe.throw(_("Shopify integration is not enabled"))
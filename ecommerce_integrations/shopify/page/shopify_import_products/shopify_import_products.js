@@ -319,15 +319,28 @@ shopify.ProductImporter = class {
 		const _syncedCounter = $("#count-products-synced");
 		const _erpnextCounter = $("#count-products-erpnext");
 
+		// updates carry an increasing seq, skip any delivered out of order
+		let _lastSeq = 0;
+
 		frappe.realtime.on(
 			"shopify.key.sync.all.products",
-			({ message, synced, done, error }) => {
+			({ seq, message, synced, done, error }) => {
+				if (seq) {
+					if (seq <= _lastSeq) return;
+					_lastSeq = seq;
+				}
+
 				message = `<pre class="mb-0">${message}</pre>`;
 				_log.append(message);
 				_log.scrollTop(_log[0].scrollHeight);
 
+				// synced is the number of newly synced products in this update
 				if (synced)
-					this.updateSyncedCount(_syncedCounter, _erpnextCounter);
+					this.updateSyncedCount(
+						_syncedCounter,
+						_erpnextCounter,
+						Number(synced)
+					);
 
 				if (done) {
 					frappe.realtime.off("shopify.key.sync.all.products");
@@ -351,11 +364,11 @@ shopify.ProductImporter = class {
 			.text(_toggleText());
 	}
 
-	updateSyncedCount(_syncedCounter, _erpnextCounter) {
+	updateSyncedCount(_syncedCounter, _erpnextCounter, count = 1) {
 		let _synced = parseFloat(_syncedCounter.text());
 		let _erpnext = parseFloat(_erpnextCounter.text());
 
-		_syncedCounter.text(_synced + 1);
-		_erpnextCounter.text(_erpnext + 1);
+		_syncedCounter.text(_synced + count);
+		_erpnextCounter.text(_erpnext + count);
 	}
 };
@@ -1,4 +1,8 @@
-from time import process_time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import threading
+from itertools import islice
+from time import perf_counter, time
 
 import frappe
 from frappe.exceptions import UniqueValidationError
@@ -7,16 +11,34 @@ from shopify.resources import Product
 from ecommerce_integrations.ecommerce_integrations.doctype.ecommerce_item import (
     ecommerce_item,
 )
-from ecommerce_integrations.shopify.connection import temp_shopify_session
-from ecommerce_integrations.shopify.constants import MODULE_NAME, SETTING_DOCTYPE
+from ecommerce_integrations.shopify.connection import shopify_session, temp_shopify_session
+from ecommerce_integrations.shopify.constants import (
+    MAX_SYNC_WORKERS,
+    MODULE_NAME,
+    SETTING_DOCTYPE,
+)
 from ecommerce_integrations.shopify.product_class import ShopifyProduct
 from ecommerce_integrations.shopify.bulk_product_import import BulkProductImport
+from ecommerce_integrations.shopify.utils import run_in_site_context
 
 # constants
 SYNC_JOB_NAME = "shopify.job.sync.all.products"
 REALTIME_KEY = "shopify.key.sync.all.products"
 BULK_SYNC_JOB_NAME = "shopify.job.sync.all.products.bulk"
 BULK_REALTIME_KEY = "shopify.key.sync.all.products.bulk"
+# products synced under a single savepoint in queue_sync_all_products
+SYNC_CHUNK_SIZE = 20
+# times a chunk rolled back by a database deadlock is synced again
+SYNC_DEADLOCK_RETRIES = 2
+# pages of 100 products synced by one job before the rest is handed to a follow-up job
+PAGES_PER_SYNC_JOB = 10
+SYNC_JOB_TIMEOUT = 3600
+# sync progress is published every PROGRESS_BATCH_SIZE products or PROGRESS_INTERVAL seconds
+PROGRESS_BATCH_SIZE = 25
+PROGRESS_INTERVAL = 2.0
+# log messages buffered before a realtime update is sent
+PUBLISH_BUFFER_SIZE = 25
+MESSAGE_SEPARATOR = "<br /><br />"
 
 
 @frappe.whitelist()
@@ -30,19 +52,14 @@ def fetch_all_products(from_=None):
 
     collection = _fetch_products_from_shopify(from_)
 
-    products = []
-    for product in collection:
-        d = product.to_dict()
-        d["synced"] = is_synced(product.id)
-        products.append(d)
+    synced_ids = get_synced_product_ids(product.id for product in collection)
 
-    next_url = None
-    if collection.has_next_page():
-        next_url = collection.next_page_url
+    products = [product.to_dict() for product in collection]
+    for d in products:
+        d["synced"] = str(d["id"]) in synced_ids
 
-    prev_url = None
-    if collection.has_previous_page():
-        prev_url = collection.previous_page_url
+    next_url = collection.next_page_url if collection.has_next_page() else None
+    prev_url = collection.previous_page_url if collection.has_previous_page() else None
 
     return {
         "products": products,
@@ -53,6 +70,11 @@ def fetch_all_products(from_=None):
 
 @temp_shopify_session
 def _fetch_products_from_shopify(from_=None, limit=20):
+    return _find_products(from_, limit)
+
+
+def _find_products(from_=None, limit=20):
+    """Fetch a page of products, the caller has to hold a Shopify session"""
     if from_:
         collection = Product.find(from_=from_)
     else:
@@ -63,11 +85,8 @@ def _fetch_products_from_shopify(from_=None, limit=20):
 
 @frappe.whitelist()
 def get_product_count():
-    items = frappe.db.get_list("Item", {"variant_of": ["is", "not set"]})
-    erpnext_count = len(items)
-
-    sync_items = frappe.db.get_list("Ecommerce Item", {"variant_of": ["is", "not set"]})
-    synced_count = len(sync_items)
+    erpnext_count = frappe.db.count("Item", {"variant_of": ["is", "not set"]})
+    synced_count = frappe.db.count("Ecommerce Item", {"variant_of": ["is", "not set"]})
 
     shopify_count = get_shopify_product_count()
 
@@ -121,9 +140,27 @@ def is_synced(product):
     return ecommerce_item.is_synced(MODULE_NAME, integration_item_code=product)
 
 
+def get_synced_product_ids(product_ids) -> set[str]:
+    """Return the subset of product_ids that are already synced, using a single query."""
+    product_ids = [str(product_id) for product_id in product_ids]
+    if not product_ids:
+        return set()
+
+    return set(
+        frappe.get_all(
+            "Ecommerce Item",
+            filters={
+                "integration": MODULE_NAME,
+                "integration_item_code": ["in", product_ids],
+            },
+            pluck="integration_item_code",
+        )
+    )
+
+
 @frappe.whitelist()
 def import_all_products():
-    setting = frappe.get_doc(SETTING_DOCTYPE)
+    setting = frappe.get_cached_doc(SETTING_DOCTYPE)
 
     if setting.enable_bulk_import:
         frappe.enqueue(
@@ -131,75 +168,299 @@ def import_all_products():
             queue="long",
             job_name=BULK_SYNC_JOB_NAME,
             key=BULK_REALTIME_KEY,
-            timeout=864000,  # 10 days in seconds
         )
     else:
         frappe.enqueue(
             queue_sync_all_products,
             queue="long",
             job_name=SYNC_JOB_NAME,
+            timeout=SYNC_JOB_TIMEOUT,
             key=REALTIME_KEY,
+            # ShopifyProduct creates shared records (e.g. item attribute values)
+            # and isn't safe to run from concurrent threads
+            max_workers=1,
+            max_pages=PAGES_PER_SYNC_JOB,
         )
 
 
-def queue_sync_all_products(*args, **kwargs):
-    start_time = process_time()
+def queue_sync_all_products(
+    *args,
+    max_workers=1,
+    max_pages=None,
+    from_=None,
+    total=None,
+    done=0,
+    started_at=None,
+    seq=0,
+    **kwargs,
+):
+    """Sync all Shopify products page by page.
+
+    With max_workers > 1 the chunks of each page are synced concurrently, each
+    worker thread using its own database connection, and the next page is
+    fetched from Shopify while the current one is being synced.
+
+    With max_pages the job stops after that many pages and enqueues a follow-up
+    job starting at the next page. If a job fails, the pages it didn't reach are
+    not synced and the sync is reported as done with an error.
+    from_, total, done, started_at and seq carry the position and progress of the
+    sync over to the follow-up jobs.
+    """
+    started_at = started_at or time()
+    publisher = RealtimePublisher(REALTIME_KEY, seq=seq)
+    try:
+        with shopify_session():
+            if from_ is None:
+                counts = get_product_count()
+                publisher.publish("Syncing all products...")
+
+                if counts["shopifyCount"] < counts["syncedCount"]:
+                    publisher.publish("⚠ Shopify has less products than ERPNext.")
+                total = counts["shopifyCount"]
+
+            progress = SyncProgress(total=total, publisher=publisher, done=done)
+            next_page_url = _sync_all_products(progress, max_workers, from_, max_pages)
+            progress.flush()
+            publisher.flush()
+
+            if next_page_url:
+                frappe.enqueue(
+                    queue_sync_all_products,
+                    queue="long",
+                    job_name=SYNC_JOB_NAME,
+                    timeout=SYNC_JOB_TIMEOUT,
+                    key=REALTIME_KEY,
+                    max_workers=max_workers,
+                    max_pages=max_pages,
+                    from_=next_page_url,
+                    total=total,
+                    done=progress.done,
+                    started_at=started_at,
+                    seq=publisher.seq,
+                )
+            else:
+                publisher.publish(f"🎉 Done in {time() - started_at:.2f}s", done=True)
+    except Exception as e:
+        # the remaining pages are not synced, let the page stop waiting
+        publisher.publish(f"❌ Error syncing products: {e!s}", error=True, done=True)
+        raise
+    finally:
+        publisher.flush()
 
-    counts = get_product_count()
-    publish("Syncing all products...")
+    return True
 
-    if counts["shopifyCount"] < counts["syncedCount"]:
-        publish("⚠ Shopify has less products than ERPNext.")
 
-    _sync = True
-    collection = _fetch_products_from_shopify(limit=100)
-    savepoint = "shopify_product_sync"
-    while _sync:
-        for product in collection:
-            try:
-                publish(f"Syncing product {product.id}", br=False)
-                frappe.db.savepoint(savepoint)
-                if is_synced(product.id):
-                    publish(f"Product {product.id} already synced. Skipping...")
-                    continue
-
-                shopify_product = ShopifyProduct(product.id)
-                shopify_product.sync_product()
-
-                publish(f"✅ Synced Product {product.id}", synced=True)
-
-            except UniqueValidationError as e:
-                publish(f"❌ Error Syncing Product {product.id} : {e!s}", error=True)
-                frappe.db.rollback(save_point=savepoint)
-                continue
+def _sync_all_products(progress, max_workers, from_=None, max_pages=None):
+    """Sync pages starting at from_, returns the url of the first page left unsynced."""
+    max_workers = max(1, min(max_workers, MAX_SYNC_WORKERS))
+    pool = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else nullcontext()
 
-            except Exception as e:
-                publish(f"❌ Error Syncing Product {product.id} : {e!s}", error=True)
-                frappe.db.rollback(save_point=savepoint)
-                continue
+    prefetch_pool = ThreadPoolExecutor(max_workers=1) if max_workers > 1 else nullcontext()
+
+    with pool as executor, prefetch_pool as prefetcher:
+        if from_:
+            collection = _find_products(from_=from_)
+        else:
+            collection = _find_products(limit=100)
+
+        pages = 0
+        while collection is not None:
+            pages += 1
+            last_page = bool(max_pages) and pages >= max_pages
+            next_page = None if last_page else _request_next_page(prefetcher, collection)
+            synced_ids = get_synced_product_ids(product.id for product in collection)
+
+            products = iter(collection)
+            chunks = iter(lambda: list(islice(products, SYNC_CHUNK_SIZE)), [])
+            if executor:
+                _sync_chunks_parallel(executor, chunks, synced_ids, progress)
+            else:
+                for chunk in chunks:
+                    _sync_products_chunk(chunk, synced_ids, progress)
 
-        if collection.has_next_page():
             frappe.db.commit()  # prevents too many write request error
-            collection = _fetch_products_from_shopify(from_=collection.next_page_url)
+            if last_page:
+                return collection.next_page_url if collection.has_next_page() else None
+            collection = next_page()
+
+
+def _request_next_page(prefetcher, collection):
+    """Start fetching the page after `collection`.
+
+    Returns a callable that gives the next page, or None after the last page.
+    With a prefetcher the page is fetched in the background.
+    """
+    if not collection.has_next_page():
+        return lambda: None
+
+    next_page_url = collection.next_page_url
+    if not prefetcher:
+        return lambda: _find_products(from_=next_page_url)
+
+    future = prefetcher.submit(
+        run_in_site_context,
+        frappe.local.site,
+        frappe.local.sites_path,
+        frappe.session.user,
+        _fetch_products_from_shopify,
+        from_=next_page_url,
+    )
+    return future.result
+
+
+class SyncProgress:
+    """Coalesces per product sync progress into periodic realtime messages.
+
+    Shared by the worker threads of a sync job, hence the lock.
+    """
+
+    def __init__(self, total, publisher, done=0):
+        self.total = total
+        self.publisher = publisher
+        self.done = done
+        self.pending = 0
+        self.pending_synced = 0
+        self.last_publish = perf_counter()
+        self.lock = threading.Lock()
+
+    def update(self, synced=False):
+        with self.lock:
+            self.done += 1
+            self.pending += 1
+            self.pending_synced += int(synced)
+
+            if (
+                self.pending >= PROGRESS_BATCH_SIZE
+                or perf_counter() - self.last_publish >= PROGRESS_INTERVAL
+            ):
+                self._publish()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self._publish()
+
+    def error(self, message):
+        self.publisher.publish(message, error=True)
+
+    def _publish(self):
+        self.publisher.publish(
+            f"Processed {self.done}/{self.total} products, {self.pending_synced} newly synced",
+            synced=self.pending_synced,
+            immediate=True,
+        )
+        self.pending = 0
+        self.pending_synced = 0
+        self.last_publish = perf_counter()
+
+
+def _sync_products_chunk(products, synced_ids, progress, retries=SYNC_DEADLOCK_RETRIES):
+    """Sync a chunk of products under a single savepoint.
+
+    If any product fails, the chunk is rolled back and retried product by product
+    so only the failing products are skipped. Products in synced_ids are skipped.
+    The chunk is committed either way, worker threads close their connection
+    right after.
+
+    A deadlock rolls back the whole transaction, savepoint included, so the chunk
+    is synced again from scratch.
+    """
+    savepoint = "shopify_product_sync_chunk"
+    results = []
+    try:
+        frappe.db.savepoint(savepoint)
+        for product in products:
+            if str(product.id) in synced_ids:
+                results.append((product.id, False))
+                continue
+
+            shopify_product = ShopifyProduct(product.id)
+            shopify_product.sync_product()
+            results.append((product.id, True))
+
+    except frappe.QueryDeadlockError:
+        frappe.db.rollback()
+        if retries:
+            _sync_products_chunk(products, synced_ids, progress, retries - 1)
         else:
-            _sync = False
+            _sync_products_one_by_one(products, synced_ids, progress)
+        return
 
-    end_time = process_time()
-    publish(f"🎉 Done in {end_time - start_time}s", done=True)
-    return True
+    except Exception:
+        frappe.db.rollback(save_point=savepoint)
+        _sync_products_one_by_one(products, synced_ids, progress)
+        return
+
+    frappe.db.commit()
+    for _product_id, synced in results:
+        progress.update(synced=synced)
+
+
+def _sync_chunks_parallel(executor, chunks, synced_ids, progress):
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+    futures = [
+        executor.submit(
+            run_in_site_context,
+            site,
+            sites_path,
+            user,
+            _sync_products_chunk,
+            chunk,
+            synced_ids,
+            progress,
+        )
+        for chunk in chunks
+    ]
+    for future in futures:
+        future.result()
+
+
+def _sync_products_one_by_one(products, synced_ids, progress):
+    # committed per product, a deadlock then only loses the product it hit
+    for product in products:
+        _sync_product_with_savepoint(product, synced_ids, progress)
+        frappe.db.commit()
+
+
+def _sync_product_with_savepoint(product, synced_ids, progress):
+    savepoint = "shopify_product_sync"
+    try:
+        frappe.db.savepoint(savepoint)
+        if str(product.id) in synced_ids:
+            progress.update()
+            return
+
+        shopify_product = ShopifyProduct(product.id)
+        shopify_product.sync_product()
+
+        progress.update(synced=True)
+
+    except frappe.QueryDeadlockError as e:
+        progress.error(f"❌ Error Syncing Product {product.id} : {e!s}")
+        # the savepoint was rolled back with the transaction
+        frappe.db.rollback()
+
+    except UniqueValidationError as e:
+        progress.error(f"❌ Error Syncing Product {product.id} : {e!s}")
+        frappe.db.rollback(save_point=savepoint)
+
+    except Exception as e:
+        progress.error(f"❌ Error Syncing Product {product.id} : {e!s}")
+        frappe.db.rollback(save_point=savepoint)
 
 
 def queue_bulk_sync_all_products(*args, **kwargs):
-    start_time = process_time()
+    start_time = perf_counter()
     publish("Starting bulk product import...", key=BULK_REALTIME_KEY)
 
     try:
         bulk_import = BulkProductImport()
-        bulk_import.run_bulk_import()
+        bulk_import.queue_bulk_import()
 
-        end_time = process_time()
+        end_time = perf_counter()
         publish(
-            f"🎉 Bulk import completed in {end_time - start_time}s",
+            f"🎉 Bulk export started in {end_time - start_time:.2f}s, "
+            "products will be imported once Shopify has prepared the export",
             done=True,
             key=BULK_REALTIME_KEY,
         )
@@ -217,13 +478,62 @@ def queue_bulk_sync_all_products(*args, **kwargs):
         return False
 
 
+class RealtimePublisher:
+    """Buffers log messages and sends them as a single realtime update.
+
+    The buffer is sent once it holds PUBLISH_BUFFER_SIZE messages, on errors,
+    when the job is done, on flush() and with messages published with
+    immediate=True, e.g. progress updates which are already aggregated.
+
+    Every update carries an increasing seq so the page can drop updates
+    delivered out of order.
+    """
+
+    def __init__(self, key, seq=0):
+        self.key = key
+        self.seq = seq
+        self.buffer = []
+        self.synced = 0
+        self.lock = threading.Lock()
+
+    def publish(self, message, synced=0, error=False, done=False, immediate=False):
+        with self.lock:
+            self.buffer.append(message)
+            self.synced += int(synced)
+
+            if immediate or error or done or len(self.buffer) >= PUBLISH_BUFFER_SIZE:
+                self._flush(error=error, done=done)
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self._flush()
+
+    def _flush(self, error=False, done=False):
+        self.seq += 1
+        frappe.publish_realtime(
+            self.key,
+            {
+                "seq": self.seq,
+                "synced": self.synced,
+                "error": error,
+                "message": MESSAGE_SEPARATOR.join(self.buffer) + MESSAGE_SEPARATOR,
+                "done": done,
+            },
+            after_commit=False,
+        )
+        self.buffer = []
+        self.synced = 0
+
+
 def publish(message, synced=False, error=False, done=False, br=True, key=REALTIME_KEY):
     frappe.publish_realtime(
         key,
         {
             "synced": synced,
             "error": error,
-            "message": message + ("<br /><br />" if br else ""),
+            "message": message + (MESSAGE_SEPARATOR if br else ""),
             "done": done,
         },
+        after_commit=False,
     )
@@ -1,7 +1,7 @@
 """Test product import page."""
 
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 import json
 import os
 
@@ -11,7 +11,18 @@ from ecommerce_integrations.shopify.product_class import ShopifyProduct
 from ecommerce_integrations.shopify.constants import SETTING_DOCTYPE
 
 from ...tests.utils import TestCase
-from .shopify_import_products import queue_sync_all_products
+from .shopify_import_products import (
+    PROGRESS_BATCH_SIZE,
+    REALTIME_KEY,
+    RealtimePublisher,
+    SyncProgress,
+    _sync_all_products,
+    _sync_products_chunk,
+    get_synced_product_ids,
+    queue_sync_all_products,
+)
+
+MODULE = "ecommerce_integrations.shopify.page.shopify_import_products.shopify_import_products"
 
 
 class TestShopifyImportProducts(TestCase):
@@ -78,6 +89,9 @@ class TestShopifyImportProducts(TestCase):
 
         queue_sync_all_products()
 
+        self.assertEqual(get_synced_product_ids(required_products), set(required_products))
+        self.assertEqual(get_synced_product_ids(["unknown-product"]), set())
+
         for product, required_variants in required_products.items():
             # has_variants is needed to avoid get_erpnext_item()
             # fetching the variant instead of template because of
@@ -110,9 +124,182 @@ class TestShopifyImportProducts(TestCase):
             self.assertEqual(len(created_ecom_variants), len(required_variants))
             self.assertEqual(sorted(required_variants), sorted(created_ecom_variants))
 
+    @patch("frappe.publish_realtime")
+    def test_sync_progress_is_published_unbuffered(self, mock_publish):
+        """Test aggregated progress bypasses the log message buffer"""
+        progress = SyncProgress(total=100, publisher=RealtimePublisher(REALTIME_KEY))
+
+        for _ in range(PROGRESS_BATCH_SIZE):
+            progress.update(synced=True)
+
+        mock_publish.assert_called_once()
+        self.assertEqual(mock_publish.call_args[0][1]["synced"], PROGRESS_BATCH_SIZE)
+
+    @patch(f"{MODULE}._find_products")
+    def test_sync_all_products_max_pages(self, mock_find_products):
+        """Test a sync stops after max_pages and returns the next page url"""
+        page = MagicMock()
+        page.__iter__.side_effect = lambda: iter([])
+        page.has_next_page.return_value = True
+        page.next_page_url = "https://example.com/products.json?page_info=next"
+        mock_find_products.return_value = page
+
+        progress = SyncProgress(total=0, publisher=RealtimePublisher(REALTIME_KEY))
+        next_page_url = _sync_all_products(progress, max_workers=1, max_pages=1)
+
+        self.assertEqual(next_page_url, page.next_page_url)
+        mock_find_products.assert_called_once_with(limit=100)
+
+    @patch("frappe.publish_realtime")
+    @patch(f"{MODULE}.frappe.enqueue")
+    @patch(f"{MODULE}.get_product_count")
+    @patch(f"{MODULE}._sync_all_products")
+    def test_sync_all_products_chained_jobs(
+        self, mock_sync, mock_count, mock_enqueue, mock_publish
+    ):
+        """Test a job hands the remaining pages and its progress to a follow-up job"""
+        mock_count.return_value = {"shopifyCount": 200, "syncedCount": 0, "erpnextCount": 0}
+
+        def sync_first_job(progress, *args):
+            progress.update(synced=True)
+            return "https://example.com/products.json?page_info=next"
+
+        mock_sync.side_effect = sync_first_job
+        queue_sync_all_products(max_workers=2, max_pages=1)
+
+        mock_enqueue.assert_called_once()
+        kwargs = mock_enqueue.call_args[1]
+        self.assertIs(mock_enqueue.call_args[0][0], queue_sync_all_products)
+        self.assertEqual(kwargs["from_"], "https://example.com/products.json?page_info=next")
+        self.assertEqual(kwargs["max_pages"], 1)
+        self.assertEqual(kwargs["max_workers"], 2)
+        self.assertEqual(kwargs["total"], 200)
+        self.assertEqual(kwargs["done"], 1)
+        self.assertTrue(kwargs["started_at"])
+        self.assertTrue(kwargs["seq"])
+        self.assertFalse(any(c[0][1]["done"] for c in mock_publish.call_args_list))
+
+        # last job of the chain
+        mock_sync.side_effect = None
+        mock_sync.return_value = None
+        mock_enqueue.reset_mock()
+        mock_publish.reset_mock()
+        mock_count.reset_mock()
+
+        job_kwargs = {k: v for k, v in kwargs.items() if k not in ("queue", "job_name", "timeout")}
+        queue_sync_all_products(**job_kwargs)
+
+        mock_count.assert_not_called()
+        mock_enqueue.assert_not_called()
+        self.assertGreater(mock_publish.call_args[0][1]["seq"], kwargs["seq"])
+        self.assertTrue(mock_publish.call_args[0][1]["done"])
+
+    @patch("frappe.publish_realtime")
+    @patch(f"{MODULE}.frappe.enqueue")
+    @patch(f"{MODULE}._sync_all_products")
+    def test_sync_all_products_job_failure(self, mock_sync, mock_enqueue, mock_publish):
+        """Test a failing job reports the sync as done with an error"""
+        mock_sync.side_effect = Exception("Shopify unavailable")
+
+        with self.assertRaises(Exception):
+            queue_sync_all_products(
+                from_="https://example.com/products.json?page_info=next", total=200
+            )
+
+        mock_enqueue.assert_not_called()
+        update = mock_publish.call_args[0][1]
+        self.assertTrue(update["done"])
+        self.assertTrue(update["error"])
+
+    @patch("frappe.publish_realtime")
+    @patch(f"{MODULE}.shopify_session")
+    def test_sync_all_products_session_failure(self, mock_session, mock_publish):
+        """Test a job that can't open a Shopify session reports the sync as done"""
+        mock_session.side_effect = frappe.ValidationError("Shopify integration is not enabled")
+
+        with self.assertRaises(frappe.ValidationError):
+            queue_sync_all_products(
+                from_="https://example.com/products.json?page_info=next", total=200
+            )
+
+        update = mock_publish.call_args[0][1]
+        self.assertTrue(update["done"])
+        self.assertTrue(update["error"])
+
     def fake_single_product_from_bulk(self, product):
         item = next(p for p in self._products if str(p["id"]) == product)
 
         product_json = json.dumps({"product": item})
 
         self.fake(f"products/{product}", body=product_json)
+
+    def test_sync_all_products_with_failing_product(self):
+        """Test a failing product only skips itself, not the rest of its chunk"""
+        self._assert_sync_with_failing_product(max_workers=1)
+
+    def test_sync_all_products_threaded_with_failing_product(self):
+        """Test a failing product doesn't roll back its chunk in worker threads"""
+        self._assert_sync_with_failing_product(max_workers=2)
+
+    def test_sync_products_chunk_deadlock(self):
+        """Test a chunk rolled back by a deadlock is synced again"""
+        products = [MagicMock(id=1), MagicMock(id=2)]
+        progress = SyncProgress(total=2, publisher=RealtimePublisher(REALTIME_KEY))
+        calls = []
+
+        def mock_shopify_product(product_id):
+            product = MagicMock()
+            if not calls:
+                product.sync_product.side_effect = frappe.QueryDeadlockError
+            calls.append(product_id)
+            return product
+
+        with patch(f"{MODULE}.ShopifyProduct", side_effect=mock_shopify_product), patch(
+            "frappe.publish_realtime"
+        ):
+            _sync_products_chunk(products, set(), progress)
+
+        self.assertEqual(calls, [1, 1, 2])
+        self.assertEqual(progress.done, 2)
+
+    def _assert_sync_with_failing_product(self, max_workers):
+        """Sync all products with the first one failing.
+
+        The mocked sync of every other product writes a marker to the database,
+        these have to be committed once the sync is done.
+        """
+        product_ids = [str(p["id"]) for p in self._products]
+        failing_product = product_ids[0]
+        marker = "test_product_sync_{}".format
+
+        self.addCleanup(frappe.db.commit)
+        self.addCleanup(frappe.db.delete, "DefaultValue", {"defkey": ["like", marker("%")]})
+
+        def mock_shopify_product(product_id):
+            product = MagicMock()
+            if str(product_id) == failing_product:
+                product.sync_product.side_effect = Exception("failed")
+            else:
+                product.sync_product.side_effect = lambda: frappe.db.set_global(
+                    marker(product_id), "1"
+                )
+            return product
+
+        self.fake(
+            "products",
+            body=self.load_fixture("bulk_products"),
+            extension="json?limit=100",
+        )
+        self.fake("products/count", body='{"count": 10}')
+
+        with patch(f"{MODULE}.ShopifyProduct", side_effect=mock_shopify_product), patch(
+            f"{MODULE}.get_synced_product_ids", return_value=set()
+        ), patch("frappe.publish_realtime"):
+            queue_sync_all_products(max_workers=max_workers)
+
+        synced = frappe.get_all(
+            "DefaultValue",
+            filters={"defkey": ["like", marker("%")]},
+            pluck="defkey",
+        )
+        self.assertEqual(set(synced), {marker(p) for p in product_ids[1:]})
@@ -2,48 +2,84 @@
 
 import json
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 
 import frappe
 from frappe.tests.utils import FrappeTestCase
 from shopify import GraphQL
 
 from ecommerce_integrations.shopify.bulk_product_import import (
+    _BULK_QUERY,
+    _get_bulk_query,
+    DOWNLOAD_TIMEOUT,
+    UNSUCCESSFUL_STATUS_MASK,
+    BulkOperationError,
     BulkProductImport,
     BulkOperationStatus,
+    import_bulk_data,
+    poll_pending_bulk_import,
+    _set_last_bulk_product_import,
+    _set_pending_bulk_operation,
 )
+from ecommerce_integrations.shopify.constants import SETTING_DOCTYPE
 from ecommerce_integrations.shopify.tests.utils import TestCase
 
 
 class TestBulkProductImport(TestCase):
     def setUp(self):
         super().setUp()
-        self.bulk_import = BulkProductImport(poll_interval=0, max_retries=1)
+        self.bulk_import = BulkProductImport(
+            poll_interval=0, max_retries=1, max_workers=1
+        )
         self.mock_graphql = MagicMock()
         self.mock_requests = MagicMock()
 
-    def test_create_bulk_query(self):
-        """Test creation of bulk query"""
-        query = self.bulk_import._create_bulk_query()
+    @staticmethod
+    def _mock_download(mock_session, *chunks):
+        """Make the patched download session stream the given byte chunks"""
+        mock_response = MagicMock()
+        mock_response.iter_content.side_effect = lambda **kwargs: iter(chunks)
+        mock_response.__enter__.return_value = mock_response
+        mock_session.get.return_value = mock_response
+        return mock_response
+
+    def test_bulk_query(self):
+        """Test bulk query contents"""
+        query = _BULK_QUERY
         self.assertIn("mutation", query)
         self.assertIn("bulkOperationRunQuery", query)
         self.assertIn("products", query)
-        self.assertIn("variants", query)
-        self.assertIn("images", query)
+        self.assertNotIn("variants", query)
+        self.assertNotIn("images", query)
+        self.assertNotIn('\\"', query)
+        self.assertNotIn("updated_at", query)
+
+    @patch(
+        "ecommerce_integrations.shopify.bulk_product_import.get_system_timezone",
+        return_value="Asia/Kolkata",
+    )
+    def test_bulk_query_updated_after(self, _mock_timezone):
+        """Test bulk query is filtered by last import time in UTC"""
+        self.assertEqual(_get_bulk_query(None), _BULK_QUERY)
+
+        query = _get_bulk_query("2024-01-02 03:04:05")
+        self.assertIn("""products(query: "updated_at:>'2024-01-01T21:34:05Z'")""", query)
 
     @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
     def test_start_bulk_operation_success(self, mock_graphql_class):
         """Test successful start of bulk operation"""
         mock_graphql = MagicMock()
         mock_graphql_class.return_value = mock_graphql
-        mock_graphql.execute.return_value = {
-            "data": {
-                "bulkOperationRunQuery": {
-                    "bulkOperation": {"id": "gid://shopify/BulkOperation/123"},
-                    "userErrors": [],
+        mock_graphql.execute.return_value = json.dumps(
+            {
+                "data": {
+                    "bulkOperationRunQuery": {
+                        "bulkOperation": {"id": "gid://shopify/BulkOperation/123"},
+                        "userErrors": [],
+                    }
                 }
             }
-        }
+        )
 
         operation_id = self.bulk_import.start_bulk_operation()
         self.assertEqual(operation_id, "gid://shopify/BulkOperation/123")
@@ -54,7 +90,30 @@ class TestBulkProductImport(TestCase):
         """Test failure to start bulk operation"""
         mock_graphql = MagicMock()
         mock_graphql_class.return_value = mock_graphql
-        mock_graphql.execute.return_value = {"errors": [{"message": "Invalid query"}]}
+        mock_graphql.execute.return_value = json.dumps(
+            {"errors": [{"message": "Invalid query"}]}
+        )
+
+        with self.assertRaises(frappe.ValidationError):
+            self.bulk_import.start_bulk_operation()
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_start_bulk_operation_user_errors(self, mock_graphql_class):
+        """Test user errors returned by the bulk operation mutation"""
+        mock_graphql = MagicMock()
+        mock_graphql_class.return_value = mock_graphql
+        mock_graphql.execute.return_value = json.dumps(
+            {
+                "data": {
+                    "bulkOperationRunQuery": {
+                        "bulkOperation": None,
+                        "userErrors": [
+                            {"field": None, "message": "Operation already in progress"}
+                        ],
+                    }
+                }
+            }
+        )
 
         with self.assertRaises(frappe.ValidationError):
             self.bulk_import.start_bulk_operation()
@@ -64,48 +123,89 @@ class TestBulkProductImport(TestCase):
         """Test polling bulk operation until completion"""
         mock_graphql = MagicMock()
         mock_graphql_class.return_value = mock_graphql
-        mock_graphql.execute.return_value = {
-            "data": {
-                "node": {
-                    "status": "COMPLETED",
-                    "url": "https://example.com/data.jsonl",
+        mock_graphql.execute.return_value = json.dumps(
+            {
+                "data": {
+                    "node": {
+                        "status": "COMPLETED",
+                        "url": "https://example.com/data.jsonl",
+                    }
                 }
             }
-        }
+        )
 
         status, url = self.bulk_import.poll_bulk_operation(
             "gid://shopify/BulkOperation/123"
         )
         self.assertEqual(status, BulkOperationStatus.COMPLETED)
         self.assertEqual(url, "https://example.com/data.jsonl")
+        mock_graphql.execute.assert_called_with(
+            ANY, variables={"id": "gid://shopify/BulkOperation/123"}
+        )
 
     @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
     def test_poll_bulk_operation_failed(self, mock_graphql_class):
         """Test polling bulk operation that failed"""
         mock_graphql = MagicMock()
         mock_graphql_class.return_value = mock_graphql
-        mock_graphql.execute.return_value = {
-            "data": {
-                "node": {
-                    "status": "FAILED",
-                    "url": None,
+        mock_graphql.execute.return_value = json.dumps(
+            {
+                "data": {
+                    "node": {
+                        "status": "FAILED",
+                        "url": None,
+                    }
                 }
             }
-        }
+        )
+
+        with self.assertRaises(frappe.ValidationError):
+            self.bulk_import.poll_bulk_operation("gid://shopify/BulkOperation/123")
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_poll_bulk_operation_canceled(self, mock_graphql_class):
+        """Test polling bulk operation that was canceled"""
+        mock_graphql = MagicMock()
+        mock_graphql_class.return_value = mock_graphql
+        mock_graphql.execute.return_value = json.dumps(
+            {"data": {"node": {"status": "CANCELED", "url": None}}}
+        )
 
         with self.assertRaises(frappe.ValidationError):
             self.bulk_import.poll_bulk_operation("gid://shopify/BulkOperation/123")
 
-    @patch("ecommerce_integrations.shopify.bulk_product_import.requests")
-    def test_download_bulk_data(self, mock_requests):
+    def test_unsuccessful_status_mask(self):
+        """Test only failed, canceled and expired statuses are unsuccessful"""
+        unsuccessful = {
+            status
+            for status in BulkOperationStatus
+            if status & UNSUCCESSFUL_STATUS_MASK
+        }
+        self.assertEqual(
+            unsuccessful,
+            {
+                BulkOperationStatus.FAILED,
+                BulkOperationStatus.CANCELED,
+                BulkOperationStatus.EXPIRED,
+            },
+        )
+
+    def test_poll_delay_backoff(self):
+        """Test poll delay doubles per retry and is capped"""
+        bulk_import = BulkProductImport(poll_interval=30, max_poll_interval=200)
+        delays = [bulk_import._get_poll_delay(retries) for retries in range(5)]
+        self.assertEqual(delays, [30, 60, 120, 200, 200])
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import._DOWNLOAD_SESSION")
+    def test_download_bulk_data(self, mock_session):
         """Test downloading bulk data"""
-        mock_response = MagicMock()
-        mock_response.text = '{"id":"1"}\n{"id":"2"}'
-        mock_requests.get.return_value = mock_response
+        self._mock_download(mock_session, b'{"id":"1"}\n{"id":"2"}')
 
-        data = self.bulk_import._download_bulk_data("https://example.com/data.jsonl")
-        self.assertEqual(data, '{"id":"1"}\n{"id":"2"}')
-        mock_requests.get.assert_called_once_with("https://example.com/data.jsonl")
+        chunks = self.bulk_import._download_bulk_data("https://example.com/data.jsonl")
+        self.assertEqual(list(chunks), [b'{"id":"1"}\n{"id":"2"}'])
+        mock_session.get.assert_called_once_with(
+            "https://example.com/data.jsonl", stream=True, timeout=DOWNLOAD_TIMEOUT
+        )
 
     def test_parse_jsonl_data(self):
         """Test parsing JSONL data"""
@@ -115,13 +215,23 @@ class TestBulkProductImport(TestCase):
         self.assertEqual(products[0]["id"], "1")
         self.assertEqual(products[1]["id"], "2")
 
+    def test_iter_jsonl_split_chunks(self):
+        """Test parsing JSONL records that span chunk boundaries"""
+        chunks = [b'{"id":', b'"1"}\n{"i', b'd":"2"}\n\n', b'{"id":"3"}']
+        products = list(self.bulk_import._iter_jsonl(chunks))
+        self.assertEqual([p["id"] for p in products], ["1", "2", "3"])
+
+    def test_iter_batches(self):
+        """Test grouping of parsed records into batches"""
+        records = ({"id": str(i)} for i in range(5))
+        batches = list(self.bulk_import._iter_batches(records, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
     @patch("ecommerce_integrations.shopify.bulk_product_import.ShopifyProduct")
-    @patch("ecommerce_integrations.shopify.bulk_product_import.requests")
-    def test_import_products(self, mock_requests, mock_shopify_product):
+    @patch("ecommerce_integrations.shopify.bulk_product_import._DOWNLOAD_SESSION")
+    def test_import_products(self, mock_session, mock_shopify_product):
         """Test importing products from bulk data"""
-        mock_response = MagicMock()
-        mock_response.text = '{"id":"1"}\n{"id":"2"}'
-        mock_requests.get.return_value = mock_response
+        self._mock_download(mock_session, b'{"id":"1"}\n{"id":"2"}')
 
         mock_product = MagicMock()
         mock_shopify_product.return_value = mock_product
@@ -131,6 +241,105 @@ class TestBulkProductImport(TestCase):
         self.assertEqual(mock_shopify_product.call_count, 2)
         mock_product.sync_product.assert_called()
 
+    @patch("ecommerce_integrations.shopify.bulk_product_import.ShopifyProduct")
+    def test_import_batch_product_gid(self, mock_shopify_product):
+        """Test GraphQL product GIDs are converted to REST ids"""
+        self.bulk_import._import_batch([{"id": "gid://shopify/Product/6808908169263"}])
+
+        mock_shopify_product.assert_called_once_with(product_id="6808908169263")
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.create_shopify_log")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.ShopifyProduct")
+    def test_import_batch_logs_failures_once(self, mock_shopify_product, mock_log):
+        """Test failed products of a batch are logged together"""
+        mock_shopify_product.return_value.sync_product.side_effect = Exception("failed")
+
+        failed = self.bulk_import._import_batch([{"id": "1"}, {"id": "2"}])
+
+        self.assertEqual(failed, 2)
+        mock_log.assert_called_once()
+        self.assertIn("1, 2", mock_log.call_args[1]["message"])
+        self.assertEqual(len(mock_log.call_args[1]["response_data"]), 2)
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.create_shopify_log")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.ShopifyProduct")
+    def test_import_batch_deadlock(self, mock_shopify_product, mock_log):
+        """Test a batch rolled back by a deadlock is imported again"""
+        mock_shopify_product.return_value.sync_product.side_effect = [
+            frappe.QueryDeadlockError,
+            None,
+            None,
+        ]
+
+        failed = self.bulk_import._import_batch([{"id": "1"}, {"id": "2"}])
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(mock_shopify_product.call_count, 3)
+        mock_log.assert_not_called()
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.ShopifyProduct")
+    @patch("ecommerce_integrations.shopify.bulk_product_import._DOWNLOAD_SESSION")
+    def test_import_products_updates_last_import(self, mock_session, mock_shopify_product):
+        """Test last import time is stored only when all products synced"""
+        self._mock_download(mock_session, b'{"id":"1"}')
+        mock_shopify_product.return_value.sync_product.side_effect = Exception("failed")
+        # _import_batch commits, so the stored time outlives the test
+        self.addCleanup(
+            frappe.db.set_value,
+            SETTING_DOCTYPE,
+            None,
+            "last_bulk_product_import",
+            None,
+            update_modified=False,
+        )
+
+        self.bulk_import.import_products(
+            "https://example.com/data.jsonl", "2024-01-01 00:00:00"
+        )
+        self.assertNotEqual(
+            str(frappe.db.get_single_value(SETTING_DOCTYPE, "last_bulk_product_import")),
+            "2024-01-01 00:00:00",
+        )
+
+        mock_shopify_product.return_value.sync_product.side_effect = None
+
+        self.bulk_import.import_products(
+            "https://example.com/data.jsonl", "2024-01-01 00:00:00"
+        )
+        self.assertEqual(
+            str(frappe.db.get_single_value(SETTING_DOCTYPE, "last_bulk_product_import")),
+            "2024-01-01 00:00:00",
+        )
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.run_in_site_context")
+    @patch("ecommerce_integrations.shopify.bulk_product_import._DOWNLOAD_SESSION")
+    def test_import_products_parallel(self, mock_session, mock_import_batch):
+        """Test batches are dispatched to worker threads"""
+        self._mock_download(mock_session, b'{"id":"1"}\n{"id":"2"}')
+        mock_import_batch.return_value = 0
+        self.addCleanup(
+            frappe.db.set_value,
+            SETTING_DOCTYPE,
+            None,
+            "last_bulk_product_import",
+            None,
+            update_modified=False,
+        )
+
+        bulk_import = BulkProductImport(max_workers=2)
+        bulk_import.import_products("https://example.com/data.jsonl", "2024-01-01 00:00:00")
+
+        mock_import_batch.assert_called_once()
+        _site, _sites_path, user, fn, batch = mock_import_batch.call_args[0]
+        self.assertEqual(user, frappe.session.user)
+        self.assertEqual(fn, bulk_import._import_batch)
+        self.assertEqual(batch, [{"id": "1"}, {"id": "2"}])
+        # no failures were counted, so the import time is stored
+        self.assertEqual(
+            str(frappe.db.get_single_value(SETTING_DOCTYPE, "last_bulk_product_import")),
+            "2024-01-01 00:00:00",
+        )
+
     @patch(
         "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.start_bulk_operation"
     )
@@ -152,7 +361,31 @@ class TestBulkProductImport(TestCase):
 
         mock_start.assert_called_once()
         mock_poll.assert_called_once_with("gid://shopify/BulkOperation/123")
-        mock_import_products.assert_called_once_with("https://example.com/data.jsonl")
+        mock_import_products.assert_called_once_with(
+            "https://example.com/data.jsonl", ANY
+        )
+
+    @patch(
+        "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.start_bulk_operation"
+    )
+    @patch(
+        "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.poll_bulk_operation"
+    )
+    @patch(
+        "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.import_products"
+    )
+    def test_run_bulk_import_no_changes(self, mock_import_products, mock_poll, mock_start):
+        """Test an empty export counts as a successful import"""
+        mock_start.return_value = "gid://shopify/BulkOperation/123"
+        mock_poll.return_value = (BulkOperationStatus.COMPLETED, None)
+        self.addCleanup(_set_last_bulk_product_import, None)
+
+        self.bulk_import.run_bulk_import()
+
+        mock_import_products.assert_not_called()
+        self.assertTrue(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "last_bulk_product_import")
+        )
 
     @patch(
         "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.start_bulk_operation"
@@ -163,3 +396,137 @@ class TestBulkProductImport(TestCase):
 
         with self.assertRaises(frappe.ValidationError):
             self.bulk_import.run_bulk_import()
+
+    @patch(
+        "ecommerce_integrations.shopify.bulk_product_import.BulkProductImport.start_bulk_operation"
+    )
+    def test_queue_bulk_import(self, mock_start):
+        """Test staged bulk import stores the pending operation"""
+        mock_start.return_value = "gid://shopify/BulkOperation/123"
+        self.addCleanup(_set_pending_bulk_operation, None, None)
+
+        self.bulk_import.queue_bulk_import()
+
+        self.assertEqual(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation"),
+            "gid://shopify/BulkOperation/123",
+        )
+        self.assertTrue(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation_started_at")
+        )
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.frappe.enqueue")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_poll_pending_bulk_import(self, mock_graphql_class, mock_enqueue):
+        """Test scheduled poll enqueues import once operation completes"""
+        mock_graphql = MagicMock()
+        mock_graphql_class.return_value = mock_graphql
+        mock_graphql.execute.return_value = json.dumps(
+            {"data": {"node": {"status": "RUNNING", "url": None}}}
+        )
+        self.addCleanup(_set_pending_bulk_operation, None, None)
+        _set_pending_bulk_operation("gid://shopify/BulkOperation/123", "2024-01-01 00:00:00")
+
+        poll_pending_bulk_import()
+        mock_enqueue.assert_not_called()
+
+        mock_graphql.execute.return_value = json.dumps(
+            {
+                "data": {
+                    "node": {
+                        "status": "COMPLETED",
+                        "url": "https://example.com/data.jsonl",
+                    }
+                }
+            }
+        )
+
+        poll_pending_bulk_import()
+        mock_enqueue.assert_called_once()
+        self.assertIs(mock_enqueue.call_args[0][0], import_bulk_data)
+        self.assertEqual(
+            mock_enqueue.call_args[1]["data_url"], "https://example.com/data.jsonl"
+        )
+        self.assertEqual(
+            str(mock_enqueue.call_args[1]["started_at"]), "2024-01-01 00:00:00"
+        )
+        self.assertFalse(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation")
+        )
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.frappe.enqueue")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_poll_pending_bulk_import_errors(self, mock_graphql_class, mock_enqueue):
+        """Test the pending operation is only dropped once it can't complete"""
+        mock_graphql = MagicMock()
+        mock_graphql_class.return_value = mock_graphql
+        self.addCleanup(_set_pending_bulk_operation, None, None)
+        _set_pending_bulk_operation("gid://shopify/BulkOperation/123", "2024-01-01 00:00:00")
+
+        mock_graphql.execute.side_effect = Exception("Connection reset")
+        poll_pending_bulk_import()
+        self.assertEqual(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation"),
+            "gid://shopify/BulkOperation/123",
+        )
+
+        mock_graphql.execute.side_effect = None
+        mock_graphql.execute.return_value = json.dumps(
+            {"data": {"node": {"status": "EXPIRED", "url": None}}}
+        )
+        poll_pending_bulk_import()
+        self.assertFalse(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation")
+        )
+        mock_enqueue.assert_not_called()
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.frappe.enqueue")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_poll_pending_bulk_import_no_changes(self, mock_graphql_class, mock_enqueue):
+        """Test a completed export without url moves the last import time forward"""
+        mock_graphql_class.return_value.execute.return_value = json.dumps(
+            {"data": {"node": {"status": "COMPLETED", "url": None}}}
+        )
+        self.addCleanup(_set_last_bulk_product_import, None)
+        self.addCleanup(_set_pending_bulk_operation, None, None)
+        _set_pending_bulk_operation("gid://shopify/BulkOperation/123", "2024-01-01 00:00:00")
+
+        poll_pending_bulk_import()
+
+        mock_enqueue.assert_not_called()
+        self.assertEqual(
+            str(frappe.db.get_single_value(SETTING_DOCTYPE, "last_bulk_product_import")),
+            "2024-01-01 00:00:00",
+        )
+        self.assertFalse(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation")
+        )
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.create_shopify_log")
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_poll_pending_bulk_import_disabled(self, mock_graphql_class, mock_log):
+        """Test nothing is polled or logged while the integration is disabled"""
+        self.addCleanup(_set_pending_bulk_operation, None, None)
+        _set_pending_bulk_operation("gid://shopify/BulkOperation/123", "2024-01-01 00:00:00")
+
+        with patch.object(
+            frappe.get_cached_doc(SETTING_DOCTYPE).__class__, "is_enabled", return_value=False
+        ):
+            poll_pending_bulk_import()
+
+        mock_graphql_class.assert_not_called()
+        mock_log.assert_not_called()
+        self.assertEqual(
+            frappe.db.get_single_value(SETTING_DOCTYPE, "pending_bulk_operation"),
+            "gid://shopify/BulkOperation/123",
+        )
+
+    @patch("ecommerce_integrations.shopify.bulk_product_import.GraphQL")
+    def test_bulk_operation_error(self, mock_graphql_class):
+        """Test terminal statuses raise BulkOperationError"""
+        mock_graphql_class.return_value.execute.return_value = json.dumps(
+            {"data": {"node": {"status": "FAILED", "url": None}}}
+        )
+
+        with self.assertRaises(BulkOperationError):
+            self.bulk_import.get_bulk_operation_status("gid://shopify/BulkOperation/123")
@@ -18,6 +18,17 @@ def create_shopify_log(**kwargs):
 	return create_log(module_def=MODULE_NAME, **kwargs)
 
 
+def run_in_site_context(site, sites_path, user, fn, *args, **kwargs):
+	"""Call fn from a worker thread with its own connection to the site, as user."""
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	frappe.set_user(user)
+	try:
+		return fn(*args, **kwargs)
+	finally:
+		frappe.destroy()
+
+
 def migrate_from_old_connector(payload=None, request_id=None):
 	"""This function is called to migrate data from old connector to new connector."""
 